@@ -7,30 +7,33 @@ weaknesses and possibly bypasses in the policy.
 # pylint: disable=E0602,C0103,W0621,R0903,R0201
 
 
-from httplib import HTTPResponse
-from StringIO import StringIO
-from urlparse import urlparse
-
 from burp import IBurpExtender, IScannerCheck
 
 
-class HttpDummySocket(object):
+class ContentSecurityPolicyScan(IScannerCheck):
 
-    """
-    A dummy socket object so we can use httplib to parse the response bytearray
-    """
+    """ Implements the actual passive scan """
 
-    def __init__(self, byteResponse):
-        self._file = StringIO(byteResponse)
+    __slots__ = ("_helpers", "_checks", "_wildcardChecks", "_directiveChecks")
 
-    def makefile(self, *args, **kwargs):
-        """ API compatability with `socket' """
-        return self._file
+    # Known bypass domains indexed by their reversed labels for each directive,
+    # these are built once since only one scanner object is ever created
+    BYPASS_INDEXES = dict(
+        (directive, csp_domain_index(knownBypasses))
+        for directive, knownBypasses in CSP_KNOWN_BYPASSES.iteritems())
 
+    # A `default-src' containing anything else is considered weak
+    STRONG_DEFAULT_SOURCES = frozenset([SELF, NONE, HTTPS])
 
-class ContentSecurityPolicyScan(IScannerCheck):
+    # Directives checked for, and the sources considered, unsafe content
+    UNSAFE_DIRECTIVES = (SCRIPT_SRC, STYLE_SRC)
+    UNSAFE_SOURCES = frozenset([UNSAFE_EVAL, UNSAFE_INLINE])
 
-    """ Implements the actual passive scan """
+    # Schemes of content sources loaded over insecure network protocols
+    INSECURE_SCHEMES = frozenset(["http", "ws"])
+
+    # Scheme-only sources never match a known bypass domain
+    SCHEME_SOURCES = frozenset([HTTP, HTTPS, DATA, BLOB])
 
     def __init__(self, callbacks):
         """
@@ -45,12 +48,20 @@ class ContentSecurityPolicyScan(IScannerCheck):
             self.deprecatedHeaderCheck,
             self.reportOnlyHeaderCheck,
             self.unsafeContentSourceCheck,
+            self.missingDirectiveCheck,
+            self.weakDefaultSourceCheck,
+        ]
+
+        # Directive checks are called with each directive and its content
+        # sources, so the whole policy is only walked once per header. The
+        # wildcard checks are skipped entirely when the header has no '*'
+        self._wildcardChecks = [
             self.wildcardContentSourceCheck,
             self.wildcardSubdomainContentSourceCheck,
+        ]
+        self._directiveChecks = [
             self.insecureContentSourceCheck,
             self.nonceSourceCheck,
-            self.missingDirectiveCheck,
-            self.weakDefaultSourceCheck,
             self.knownBypassCheck,
         ]
 
@@ -88,62 +99,82 @@ class ContentSecurityPolicyScan(IScannerCheck):
     def proccessHttpResponse(self, burpHttpReqResp):
         """ Processes only the HTTP repsonses with a CSP header """
         byteResponse = burpHttpReqResp.getResponse()
-        httpSocket = HttpDummySocket(bytearray(byteResponse))
-        response = HTTPResponse(httpSocket)
-        response.begin()
+        cspHeaders = list(csp_iter_headers(bytearray(byteResponse)))
+        if not cspHeaders:
+            return []
+        # Analyzing the request re-parses it, so only do it once per response
+        httpService = burpHttpReqResp.getHttpService()
+        url = self._getUrl(burpHttpReqResp)
         issues = []
-        for header in response.getheaders():
-            if header[0].lower() in ContentSecurityPolicy.HEADERS:
-                findings = self.parseContentSecurityPolicy(header, burpHttpReqResp)
-                issues.extend(findings)
+        seen = set()
+        for header in cspHeaders:
+            findings = self.parseContentSecurityPolicy(
+                header, burpHttpReqResp, httpService, url)
+            # Several headers or sources often produce the same finding, drop
+            # those here rather than leave Burp to consolidate them pairwise
+            for issue in findings:
+                key = issue.dedupKey()
+                if key not in seen:
+                    seen.add(key)
+                    issues.append(issue)
         return issues
 
-    def parseContentSecurityPolicy(self, cspHeader, burpHttpReqResp):
+    def parseContentSecurityPolicy(self, cspHeader, burpHttpReqResp,
+                                   httpService, url):
         """ Parses the CSP response header and searches for issues """
-        csp = ContentSecurityPolicy(cspHeader[0], cspHeader[1])
+        csp = csp_parse(cspHeader[0], cspHeader[1])
         issues = []
         for check in self._checks:
-            issues.extend(check(csp, burpHttpReqResp))
+            issues.extend(check(csp, burpHttpReqResp, httpService, url))
+        directiveChecks = self._directiveChecks
+        if "*" in csp.header_value:
+            directiveChecks = self._wildcardChecks + directiveChecks
+        for directive, sources in csp.iteritems():
+            if sources is None:
+                continue  # Skip unspecified directives in NO_FALLBACK
+            for check in directiveChecks:
+                issues.extend(check(directive, sources, burpHttpReqResp,
+                                    httpService, url))
         return issues
 
-    def deprecatedHeaderCheck(self, csp, burpHttpReqResp):
+    def deprecatedHeaderCheck(self, csp, burpHttpReqResp, httpService, url):
         """
         Checks for the use of a deprecated header such as `X-WebKit-CSP'
         """
         issues = []
         if csp.is_deprecated_header():
             deprecatedHeader = DeprecatedHeader(
-                httpService=burpHttpReqResp.getHttpService(),
-                url=self._getUrl(burpHttpReqResp),
+                httpService=httpService,
+                url=url,
                 httpMessages=burpHttpReqResp,
                 severity="Medium",
                 confidence="Certain")
             issues.append(deprecatedHeader)
         return issues
 
-    def reportOnlyHeaderCheck(self, csp, burpHttpReqResp):
+    def reportOnlyHeaderCheck(self, csp, burpHttpReqResp, httpService, url):
         """
         Checks for the use of a report-only CSP header
         """
         issues = []
         if csp.is_report_only_mode():
             reportOnly = ReportOnlyHeader(
-                httpService=burpHttpReqResp.getHttpService(),
-                url=self._getUrl(burpHttpReqResp),
+                httpService=httpService,
+                url=url,
                 httpMessages=burpHttpReqResp,
                 severity="High",
                 confidence="Certain")
             issues.append(reportOnly)
         return issues
 
-    def unsafeContentSourceCheck(self, csp, burpHttpReqResp):
+    def unsafeContentSourceCheck(self, csp, burpHttpReqResp, httpService, url):
         """ Checks the current CSP header for unsafe content sources """
         issues = []
-        for directive in [SCRIPT_SRC, STYLE_SRC]:
-            if UNSAFE_EVAL in csp[directive] or UNSAFE_INLINE in csp[directive]:
+        for directive in self.UNSAFE_DIRECTIVES:
+            if not self.UNSAFE_SOURCES.isdisjoint(csp[directive]):
                 unsafeContent = UnsafeContentSource(
-                    httpService=burpHttpReqResp.getHttpService(),
-                    url=self._getUrl(burpHttpReqResp),
+                    httpService=httpService,
+                    url=url,
                     httpMessages=burpHttpReqResp,
                     severity="High",
                     confidence="Certain",
@@ -151,135 +182,131 @@ class ContentSecurityPolicyScan(IScannerCheck):
                 issues.append(unsafeContent)
         return issues
 
-    def wildcardContentSourceCheck(self, csp, burpHttpReqResp):
+    def wildcardContentSourceCheck(self, directive, sources, burpHttpReqResp,
+                                   httpService, url):
         """
         Check content sources for wildcards '*' note that wilcard subdomains
         are checked by `wildcardSubdomainContentSourceCheck'
         """
         issues = []
-        for directive, sources in csp.iteritems():
-            if sources is None:
-                continue  # Skip unspecified directives in NO_FALLBACK
-            if any(src == "*" for src in sources):
-                wildcardContent = WildcardContentSource(
-                    httpService=burpHttpReqResp.getHttpService(),
-                    url=self._getUrl(burpHttpReqResp),
-                    httpMessages=burpHttpReqResp,
-                    severity="Medium",
-                    confidence="Certain",
-                    directive=directive)
-                issues.append(wildcardContent)
+        if "*" in sources:
+            wildcardContent = WildcardContentSource(
+                httpService=httpService,
+                url=url,
+                httpMessages=burpHttpReqResp,
+                severity="Medium",
+                confidence="Certain",
+                directive=directive)
+            issues.append(wildcardContent)
         return issues
 
-    def wildcardSubdomainContentSourceCheck(self, csp, burpHttpReqResp):
+    def wildcardSubdomainContentSourceCheck(self, directive, sources,
+                                            burpHttpReqResp, httpService, url):
         """ Check content sources for wildcards subdomains '*.foo.com' """
         issues = []
-        for directive, sources in csp.iteritems():
-            if sources is None:
-                continue
-            # This check is a little hacky but should work well
-            # the shortest subdomain string should be like *.a.bc
-            if any("*" in src and 5 <= len(src) for src in sources):
-                wilcardSubdomain = WildcardSubdomainContentSource(
-                    httpService=burpHttpReqResp.getHttpService(),
-                    url=self._getUrl(burpHttpReqResp),
-                    httpMessages=burpHttpReqResp,
-                    severity="Low",
-                    confidence="Certain",
-                    directive=directive)
-                issues.append(wilcardSubdomain)
+        # This check is a little hacky but should work well
+        # the shortest subdomain string should be like *.a.bc
+        if any("*" in src and 5 <= len(src) for src in sources):
+            wilcardSubdomain = WildcardSubdomainContentSource(
+                httpService=httpService,
+                url=url,
+                httpMessages=burpHttpReqResp,
+                severity="Low",
+                confidence="Certain",
+                directive=directive)
+            issues.append(wilcardSubdomain)
         return issues
 
-    def nonceSourceCheck(self, csp, burpHttpReqResp):
+    def nonceSourceCheck(self, directive, sources, burpHttpReqResp,
+                         httpService, url):
         """
         Check content sources for wildcards '*' note that wilcard subdomains
         are checked by `wildcardSubdomainContentSourceCheck'
         """
         issues = []
-        for directive, sources in csp.iteritems():
-            if sources is None:
-                continue
-            if any(src.startswith("'nonce-") for src in sources):
-                nonceContent = NonceContentSource(
-                    httpService=burpHttpReqResp.getHttpService(),
-                    url=self._getUrl(burpHttpReqResp),
-                    httpMessages=burpHttpReqResp,
-                    severity="Informational",
-                    confidence="Certain",
-                    directive=directive)
-                issues.append(nonceContent)
+        if any(src.startswith("'nonce-") for src in sources):
+            nonceContent = NonceContentSource(
+                httpService=httpService,
+                url=url,
+                httpMessages=burpHttpReqResp,
+                severity="Informational",
+                confidence="Certain",
+                directive=directive)
+            issues.append(nonceContent)
         return issues
 
-    def insecureContentSourceCheck(self, csp, burpHttpReqResp):
+    def insecureContentSourceCheck(self, directive, sources, burpHttpReqResp,
+                                   httpService, url):
         """ Check content sources that allow insecure network protocols """
         issues = []
-        for directive, sources in csp.iteritems():
-            if sources is None:
-                continue
-            for src in sources:
-                if src == HTTP or urlparse(src).scheme in ["http", "ws"]:
-                    insecureContent = InsecureContentDirective(
-                        httpService=burpHttpReqResp.getHttpService(),
-                        url=self._getUrl(burpHttpReqResp),
-                        httpMessages=burpHttpReqResp,
-                        severity="High",
-                        confidence="Certain",
-                        directive=directive)
-                    issues.append(insecureContent)
+        for src in sources:
+            scheme, sep, _ = src.partition(":")
+            if sep and scheme in self.INSECURE_SCHEMES:
+                insecureContent = InsecureContentDirective(
+                    httpService=httpService,
+                    url=url,
+                    httpMessages=burpHttpReqResp,
+                    severity="High",
+                    confidence="Certain",
+                    directive=directive)
+                issues.append(insecureContent)
         return issues
 
-    def missingDirectiveCheck(self, csp, burpHttpReqResp):
+    def missingDirectiveCheck(self, csp, burpHttpReqResp, httpService, url):
         """
         Check for missing directives that do not inherit from `default-src'
         """
         issues = []
-        for directive in ContentSecurityPolicy.NO_FALLBACK:
-            if directive not in csp:
-                missingDirective = MissingDirective(
-                    httpService=burpHttpReqResp.getHttpService(),
-                    url=self._getUrl(burpHttpReqResp),
-                    httpMessages=burpHttpReqResp,
-                    severity="Medium",
-                    confidence="Certain",
-                    directive=directive)
-                issues.append(missingDirective)
+        missing = ContentSecurityPolicy.NO_FALLBACK.difference(csp.directives())
+        for directive in missing:
+            missingDirective = MissingDirective(
+                httpService=httpService,
+                url=url,
+                httpMessages=burpHttpReqResp,
+                severity="Medium",
+                confidence="Certain",
+                directive=directive)
+            issues.append(missingDirective)
         return issues
 
-    def weakDefaultSourceCheck(self, csp, burpHttpReqResp):
+    def weakDefaultSourceCheck(self, csp, burpHttpReqResp, httpService, url):
         """
         Any `default-src' that is not 'none'/'self'/https: is considered weak
         """
         issues = []
-        for contentSource in csp[DEFAULT_SRC]:
-            if contentSource not in [SELF, NONE, HTTPS]:
-                weakDefault = WeakDefaultSource(
-                    httpService=burpHttpReqResp.getHttpService(),
-                    url=self._getUrl(burpHttpReqResp),
-                    httpMessages=burpHttpReqResp,
-                    severity="Medium",
-                    confidence="Certain")
-                issues.append(weakDefault)
-                break
+        if any(contentSource not in self.STRONG_DEFAULT_SOURCES
+               for contentSource in csp[DEFAULT_SRC]):
+            weakDefault = WeakDefaultSource(
+                httpService=httpService,
+                url=url,
+                httpMessages=burpHttpReqResp,
+                severity="Medium",
+                confidence="Certain")
+            issues.append(weakDefault)
         return issues
 
-    def knownBypassCheck(self, csp, burpHttpReqResp):
+    def knownBypassCheck(self, directive, sources, burpHttpReqResp,
+                         httpService, url):
         """
         Parses the CSP for known bypasses, this check is a little more
         complicated, and calls into other subroutines.
         """
         issues = []
-        for directive, knownBypasses in CSP_KNOWN_BYPASSES.iteritems():
-            bypasses = self._bypassCheckDirective(csp, directive, knownBypasses)
-            for bypass in bypasses:
-                bypassIssue = self._createBypassIssue(directive, bypass, burpHttpReqResp)
-                issues.append(bypassIssue)
+        bypassIndex = self.BYPASS_INDEXES.get(directive)
+        if bypassIndex is None:
+            return issues  # No known bypasses for this directive
+        for bypass in self._bypassCheckDirective(sources, bypassIndex):
+            bypassIssue = self._createBypassIssue(
+                directive, bypass, burpHttpReqResp, httpService, url)
+            issues.append(bypassIssue)
         return issues
 
-    def _createBypassIssue(self, directive, bypass, burpHttpReqResp):
+    def _createBypassIssue(self, directive, bypass, burpHttpReqResp,
+                           httpService, url):
         """ Creates the KnownCSPBypass issue object """
         knownBypass = KnownCSPBypass(
-            httpService=burpHttpReqResp.getHttpService(),
-            url=self._getUrl(burpHttpReqResp),
+            httpService=httpService,
+            url=url,
             httpMessages=burpHttpReqResp,
             severity="High",
             confidence="Certain",
@@ -287,22 +314,20 @@ class ContentSecurityPolicyScan(IScannerCheck):
             bypass=bypass)
         return knownBypass
 
-    def _bypassCheckDirective(self, csp, directive, knownBypasses):
+    def _bypassCheckDirective(self, sources, bypassIndex):
         """
         Check an individual directive (e.g. `script-src') to see if it contains
-        any domains that host known CSP bypasses.
+        any domains that host known CSP bypasses, yields (domain, payload)
+        tuples straight from the index.
         """
-        bypasses = []
-        for src in csp[directive]:
-            if src.startswith("'") or src in [HTTP, HTTPS, DATA, BLOB]:
+        for src in sources:
+            if src[:1] == "'" or src in self.SCHEME_SOURCES:
                 continue  # We only care about domains
 
-            # Iterate over all bypasses and check if `src' allows loading
-            # content from `domain' if so, we have a bypass!
-            for domain, payload in knownBypasses:
-                if csp_match_domains(src, domain):
-                    bypasses.append((domain, payload,))
-        return bypasses
+            # Walk the index once to find every known bypass domain that
+            # `src' allows loading content from, if any we have a bypass!
+            for bypass in csp_match_domain_index(src, bypassIndex):
+                yield bypass
 
 
 class BurpExtender(IBurpExtender):
@@ -16,6 +16,9 @@ class BaseCSPIssue(IScanIssue):
     constructor so we can track what directive we're reporting about.
     """
 
+    __slots__ = ("_httpService", "_url", "_httpMessages", "_severity",
+                 "_confidence", "_directive")
+
     # pylint: disable=R0913
     def __init__(self, httpService, url, httpMessages, severity, confidence,
                  directive=None):
@@ -29,6 +32,13 @@ class BaseCSPIssue(IScanIssue):
         self._confidence = confidence
         self._directive = directive
 
+    def dedupKey(self):
+        """
+        Identifies duplicate findings within a single response, the URL and
+        HTTP service are the same for every issue in a response.
+        """
+        return (self.__class__, self._directive)
+
     def getUrl(self):
         """
         This method returns the URL for which the issue was generated.
@@ -145,6 +155,8 @@ class WildcardContentSource(BaseCSPIssue):
     Wildcard content sources. Note: this does not flag wildcard subdomains
     """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Wildcard Content Source: %s" % self._directive
 
@@ -162,6 +174,8 @@ class WildcardSubdomainContentSource(BaseCSPIssue):
     Wildcard subdomain content sources.
     """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Wildcard Subdomain Content Source: %s" % self._directive
 
@@ -178,6 +192,8 @@ class UnsafeContentSource(BaseCSPIssue):
 
     """ Any directive that allows unsafe content (e.g. 'unsafe-eval') """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Unsafe Content Source: %s" % self._directive
 
@@ -194,6 +210,8 @@ class InsecureContentDirective(BaseCSPIssue):
     Any directive that allows insecure network protocols (e.g. ws: or http:)
     """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Insecure Content Source: %s" % self._directive
 
@@ -213,6 +231,8 @@ class MissingDirective(BaseCSPIssue):
     CSP and do not fallback to `default-src'.
     """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Missing CSP Directive: %s" % self._directive
 
@@ -229,6 +249,8 @@ class WeakDefaultSource(BaseCSPIssue):
 
     """ Any `default-src' that is not 'none' 'self' or 'https:' """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Weak default-src Directive"
 
@@ -248,6 +270,8 @@ class DeprecatedHeader(BaseCSPIssue):
 
     """ Flags use of `X-WebKit-CSP' and `X-Content-Security-Policy' """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Deprecated Header"
 
@@ -262,6 +286,8 @@ class ReportOnlyHeader(BaseCSPIssue):
 
     """ Flags use of `Content-Security-Policy-Report-Only' """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Report Only Header"
 
@@ -276,6 +302,8 @@ class NonceContentSource(BaseCSPIssue):
 
     """ Alerts the user that a `nonce-' source was found """
 
+    __slots__ = ()
+
     def getIssueName(self):
         return "Nonce Content Source"
 
@@ -291,6 +319,8 @@ class KnownCSPBypass(BaseCSPIssue):
 
     """ Reports a known bypass in a domain whitelisted by a CSP """
 
+    __slots__ = ("_bypass",)
+
     # pylint: disable=W0231,R0913
     def __init__(self, httpService, url, httpMessages, severity, confidence,
                  directive=None, bypass=None):
@@ -305,6 +335,9 @@ class KnownCSPBypass(BaseCSPIssue):
         self._directive = directive
         self._bypass = bypass
 
+    def dedupKey(self):
+        return (self.__class__, self._directive, self._bypass[0])
+
     def getIssueName(self):
         return "Known CSP Bypass: %s" % self._directive
 
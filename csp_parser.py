@@ -5,8 +5,7 @@ A basic Content Security Policy parser.
 """
 # pylint: disable=C0103,C0111,R0201
 
-from collections import defaultdict
-from urlparse import urlparse
+import re
 
 ### Constants
 BASE_URI = "base-uri"
@@ -42,27 +41,130 @@ DATA = "data:"
 FILESYSTEM = "filesystem:"
 MEDIASTREAM = "mediastream:"
 
+# Matches a single policy, a directive name followed by its content sources
+CSP_POLICY_REGEX = re.compile(r"([^;\s]+)([^;]*)")
+
+# Maximum number of parsed policies kept by `csp_parse'
+CSP_PARSE_CACHE_SIZE = 256
+_csp_parse_cache = {}
+
+
+def _csp_source_host(content_src):
+    """ Isolate just the domain incase there is a scheme/etc. """
+    scheme, sep, rest = content_src.lower().partition("://")
+    if sep:
+        return rest.partition("/")[0]
+    return scheme
+
 
 def csp_match_domains(content_src, domain):
     """ Does a `content_src' allow a `domain' """
-    # Isolate just the domain incase there is a scheme/etc.
-    content_src = content_src.lower()
-    domain = domain.lower()
-    if urlparse(content_src).netloc != '':
-        content_src = urlparse(content_src).netloc
-
-    src_parts = content_src.split(".")[::-1]  # Reverse the domains
-    domain_parts = domain.split(".")[::-1]
+    src_parts = _csp_source_host(content_src).split(".")
+    src_parts.reverse()  # Compare the labels right-to-left
+    domain_parts = domain.lower().split(".")
+    domain_parts.reverse()
     for index, src_part in enumerate(src_parts):
         if src_part == "*":
-            return True
-        if src_part == domain_parts[index]:
-            continue
-        else:
+            return index < len(domain_parts)
+        if len(domain_parts) <= index or src_part != domain_parts[index]:
             return False
     return len(src_parts) == len(domain_parts)
 
 
+def csp_domain_index(entries):
+    """
+    Builds an index of `entries' (tuples whose first item is a domain) keyed
+    on the reversed domain labels, this lets `csp_match_domain_index' match a
+    content source against every domain in a single pass.
+    """
+    index = {}
+    for entry in entries:
+        node = index
+        for label in reversed(entry[0].lower().split(".")):
+            node = node.setdefault(label, {})
+        node.setdefault(None, []).append(entry)
+    _csp_flatten_domain_index(index)
+    return index
+
+
+def _csp_flatten_domain_index(node):
+    """
+    Stores a flat tuple of every entry beneath `node' under the "*" key, so a
+    wildcard can be matched without walking the rest of the index. Returns
+    the entries at and beneath `node'.
+    """
+    beneath = []
+    for label, child in node.items():
+        if label is not None:
+            beneath.extend(_csp_flatten_domain_index(child))
+    node["*"] = tuple(beneath)
+    return node.get(None, []) + beneath
+
+
+def csp_match_domain_index(content_src, index):
+    """ Yields the entries in a domain `index' allowed by a `content_src' """
+    node = index
+    for src_part in reversed(_csp_source_host(content_src).split(".")):
+        if src_part == "*":
+            for entry in node["*"]:
+                yield entry
+            return
+        node = node.get(src_part)
+        if node is None:
+            return
+    for entry in node.get(None, []):
+        yield entry
+
+
+def csp_parse(header_name, header_value):
+    """
+    Returns a ContentSecurityPolicy for a header, most sites serve the same
+    policy on every response so parsed policies are cached on the raw header.
+    The returned policy is shared and must be treated as read-only.
+    """
+    key = (header_name.lower(), header_value)
+    csp = _csp_parse_cache.get(key)
+    if csp is None:
+        csp = ContentSecurityPolicy(header_name, header_value)
+        if CSP_PARSE_CACHE_SIZE <= len(_csp_parse_cache):
+            _csp_parse_cache.clear()  # Crude, but cheap and never grows
+        _csp_parse_cache[key] = csp
+    return csp
+
+
+def csp_iter_headers(raw_response):
+    """
+    Yields a (name, value) tuple for each CSP header in a raw HTTP response,
+    header names are lowercased. Only the header block is split, the body of
+    the response is never copied.
+    """
+    # The header block ends at the first blank line, CRLF or bare LF
+    end = len(raw_response)
+    for separator in ("\r\n\r\n", "\n\n"):
+        index = raw_response.find(separator, 0, end)
+        if index != -1:
+            end = index
+    header_block = str(raw_response[:end])
+    # Every CSP header name contains one of these, so most responses can be
+    # ruled out with a single substring search of the header block
+    lowered_block = header_block.lower()
+    if "content-security-policy" not in lowered_block \
+            and "x-webkit-csp" not in lowered_block:
+        return
+    headers = []
+    for line in header_block.split("\n")[1:]:  # Skip the status line
+        line = line.rstrip("\r")
+        if line[:1] in (" ", "\t") and headers:
+            # Folded header, the line continues the previous header's value
+            headers[-1][1] += " " + line.strip()
+            continue
+        name, _, value = line.partition(":")
+        headers.append([name.strip().lower(), value.strip()])
+    for name, value in headers:
+        if name in ContentSecurityPolicy.HEADERS:
+            yield name, value
+
+
 class ContentSecurityPolicy(object):
 
     """
@@ -70,10 +172,10 @@ class ContentSecurityPolicy(object):
     logic to return `default-src' when approiate, etc.
     """
 
-    HEADERS = ["content-security-policy",
-               "content-security-policy-report-only",
-               "x-content-security-policy",
-               "x-webkit-csp"]
+    HEADERS = frozenset(["content-security-policy",
+                         "content-security-policy-report-only",
+                         "x-content-security-policy",
+                         "x-webkit-csp"])
 
     # All content directives
     CONTENT_DIRECTIVES = [
@@ -82,15 +184,18 @@ class ContentSecurityPolicy(object):
 
         BASE_URI, FORM_ACTION, FRAME_ANCESTORS, PLUGIN_TYPES,
         REPORT_URI, SANDBOX, REFLECTIVE_XSS, REFERRER]
+    CONTENT_DIRECTIVES_SET = frozenset(CONTENT_DIRECTIVES)
 
     # These directives do not fallback to default-src
-    NO_FALLBACK = [BASE_URI, FORM_ACTION, FRAME_ANCESTORS, PLUGIN_TYPES,
-                   REPORT_URI, SANDBOX, REFLECTIVE_XSS, REFERRER]
+    NO_FALLBACK = frozenset([BASE_URI, FORM_ACTION, FRAME_ANCESTORS,
+                             PLUGIN_TYPES, REPORT_URI, SANDBOX, REFLECTIVE_XSS,
+                             REFERRER])
 
     def __init__(self, header_name, header_value):
-        self._content_policies = defaultdict(list)
+        self._content_policies = {}
         self._header_name = None
         self._header_value = None
+        self._items = None
         self.header_name = header_name
         self.header_value = header_value
 
@@ -117,16 +222,9 @@ class ContentSecurityPolicy(object):
         self._parse_header()
 
     def _parse_header(self):
-        """ Splits the header on ';' then subsequently on whitespace """
-        for policy in self._header_value.split(";"):
-            if not len(policy):
-                continue  # Skip blanks
-            directive, sources = self._unpack_policy(*policy.strip().split(" "))
-            self[directive] = sources
-
-    def _unpack_policy(self, directive, *content_sources):
-        """ Used to unpack the directive name and directives """
-        return directive, [src.strip() for src in content_sources]
+        """ Tokenizes each policy in one pass, blank policies are skipped """
+        for policy in CSP_POLICY_REGEX.finditer(self._header_value):
+            self[policy.group(1)] = policy.group(2).split()
 
     def is_deprecated_header(self):
         """ Check for X-WebKit-CSP or X-Content-Security-Policy """
@@ -135,18 +233,27 @@ class ContentSecurityPolicy(object):
     def is_report_only_mode(self):
         return self.header_name.endswith("report-only")
 
+    def directives(self):
+        """ A view of the directives explicitly set by the policy """
+        return self._content_policies.viewkeys()
+
     def iteritems(self):
-        """ Similar to a dictionary, iterates tuples of key/value pairs """
-        for key in self.CONTENT_DIRECTIVES:
-            yield (key, self[key],)
+        """
+        Similar to a dictionary, iterates tuples of key/value pairs. The pairs
+        are resolved once and reused until the policy is modified.
+        """
+        if self._items is None:
+            self._items = tuple((key, self[key],) for key in self.CONTENT_DIRECTIVES)
+        return iter(self._items)
 
     def __setitem__(self, key, value):
-        if key not in self.CONTENT_DIRECTIVES:
+        if key not in self.CONTENT_DIRECTIVES_SET:
             raise ValueError("Unknown directive '%s'" % key)
+        self._items = None
         if isinstance(value, list):
-            self._content_policies[key].extend(value)
+            self._content_policies.setdefault(key, []).extend(value)
         elif isinstance(value, basestring):
-            self._content_policies[key].append(value)
+            self._content_policies.setdefault(key, []).append(value)
         else:
             raise ValueError("Expected list or basestring")
 
@@ -154,15 +261,16 @@ class ContentSecurityPolicy(object):
         """
         Get the policy or return default-src if the policy isn't in NO_FALLBACK
         """
-        if key not in self.CONTENT_DIRECTIVES:
+        if key not in self.CONTENT_DIRECTIVES_SET:
             raise ValueError("Unknown directive '%s'" % key)
         if key in self._content_policies:
             return self._content_policies[key]
         elif key not in self.NO_FALLBACK:
-            return self._content_policies[DEFAULT_SRC]
+            # Never insert default-src here, parsed policies are shared
+            return self._content_policies.get(DEFAULT_SRC, [])
 
     def __contains__(self, item):
-        if item not in self.NO_FALLBACK and item in self.CONTENT_DIRECTIVES:
+        if item not in self.NO_FALLBACK and item in self.CONTENT_DIRECTIVES_SET:
             return True
         else:
             return item in self._content_policies
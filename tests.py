@@ -24,6 +24,10 @@ CSP_TEST_PARSER_2 = (
     CSP_HEADER_NAME,
     "default-src 'self' https:; connect-src 'self' https: http:; font-src 'self' https:; frame-src *; img-src 'self' https: http: data:; media-src 'self' https:; object-src 'self' https:; script-src 'self' https: 'unsafe-eval' 'unsafe-inline' http:; style-src 'self' https: 'unsafe-inline' http:; report-uri /tracking/csp;")
 
+CSP_TEST_WHITESPACE = (
+    CSP_HEADER_NAME,
+    " default-src  'self'\thttps://cdn.example.net ;; script-src 'none' ; ")
+
 CSP_TEST_INVALID_TYPES = (
     CSP_HEADER_NAME,
     "default-src 'self' https://cdn.example.net; foobar-src 'none';")
@@ -42,11 +46,56 @@ class TestContentSecurityPolicy(unittest.TestCase):
         self.assertTrue(SELF in csp[SCRIPT_SRC])
         self.assertTrue(UNSAFE_EVAL in csp[SCRIPT_SRC])
 
+    def test_whitespace(self):
+        csp = ContentSecurityPolicy(*CSP_TEST_WHITESPACE)
+        self.assertEqual(csp[DEFAULT_SRC], [SELF, "https://cdn.example.net"])
+        self.assertEqual(csp[SCRIPT_SRC], [NONE])
+
+    def test_iteritems(self):
+        csp = ContentSecurityPolicy(*CSP_TEST_PARSER_1)
+        items = dict(csp.iteritems())
+        self.assertEqual(items[SCRIPT_SRC], [SELF, "https://cdn.example.net"])
+        self.assertEqual(items[BASE_URI], None)
+        csp[BASE_URI] = SELF
+        self.assertEqual(dict(csp.iteritems())[BASE_URI], [SELF])
+
+    def test_directives(self):
+        csp = ContentSecurityPolicy(*CSP_TEST_PARSER_1)
+        self.assertEqual(set(csp.directives()), set([DEFAULT_SRC, CHILD_SRC, OBJECT_SRC]))
+        missing = ContentSecurityPolicy.NO_FALLBACK.difference(csp.directives())
+        self.assertTrue(REPORT_URI in missing)
+        self.assertFalse(DEFAULT_SRC in missing)
+
+    def test_directives_after_fallback(self):
+        csp = ContentSecurityPolicy(CSP_HEADER_NAME, "script-src 'self'")
+        self.assertEqual(csp[IMG_SRC], [])
+        self.assertEqual(csp[BASE_URI], None)
+        self.assertEqual(list(csp.directives()), [SCRIPT_SRC])
+
     def test_invalid_types(self):
         with self.assertRaises(ValueError):
             ContentSecurityPolicy(*CSP_TEST_INVALID_TYPES)
 
 
+class TestCSPParse(unittest.TestCase):
+
+    def test_cached(self):
+        csp = csp_parse(*CSP_TEST_PARSER_1)
+        self.assertTrue(csp is csp_parse(CSP_HEADER_NAME.lower(), CSP_TEST_PARSER_1[1]))
+        self.assertFalse(csp is csp_parse(*CSP_TEST_PARSER_2))
+
+    def test_read_only(self):
+        csp = csp_parse(CSP_HEADER_NAME, "script-src 'self'")
+        self.assertEqual(csp[IMG_SRC], [])
+        self.assertEqual(csp[DEFAULT_SRC], [])
+        self.assertEqual(list(csp.iteritems())[0], (DEFAULT_SRC, []))
+        self.assertFalse(DEFAULT_SRC in csp.directives())
+
+    def test_invalid_types(self):
+        with self.assertRaises(ValueError):
+            csp_parse(*CSP_TEST_INVALID_TYPES)
+
+
 class TestCSPMatchDomains(unittest.TestCase):
 
     def test_simple_domain_match(self):
@@ -59,8 +108,13 @@ class TestCSPMatchDomains(unittest.TestCase):
         self.assertFalse(csp_match_domains("foobar.com", "foobar.net"))
         self.assertFalse(csp_match_domains("foobar.com", "foo.bar.com"))
 
+    def test_length_mismatch(self):
+        self.assertFalse(csp_match_domains("a.foo.bar.com", "foo.bar.com"))
+        self.assertFalse(csp_match_domains("*.bar.com", "bar.com"))
+
     def test_scheme_match(self):
         self.assertTrue(csp_match_domains("ws://*.bar.com", "foo.bar.com"))
+        self.assertTrue(csp_match_domains("https://foo.bar.com/js/", "foo.bar.com"))
 
     def test_scheme_mismatch(self):
         self.assertFalse(csp_match_domains("ws://*.foo.com", "foo.bar.com"))
@@ -70,5 +124,86 @@ class TestCSPMatchDomains(unittest.TestCase):
         self.assertTrue(csp_match_domains("ajax.googleapis.com", "ajax.googleapis.com"))
 
 
+class TestCSPMatchDomainIndex(unittest.TestCase):
+
+    INDEX = csp_domain_index([
+        ("ajax.googleapis.com", "ajax"),
+        ("foo.bar.com", "foo"),
+        ("bar.com", "bar"),
+    ])
+
+    def _match(self, content_src):
+        return sorted(entry[1] for entry in csp_match_domain_index(content_src, self.INDEX))
+
+    def test_simple_domain_match(self):
+        self.assertEqual(self._match("foo.bar.com"), ["foo"])
+        self.assertEqual(self._match("bar.com"), ["bar"])
+
+    def test_wildcard_match(self):
+        self.assertEqual(self._match("*.bar.com"), ["foo"])
+        self.assertEqual(self._match("*.googleapis.com"), ["ajax"])
+        self.assertEqual(self._match("*"), ["ajax", "bar", "foo"])
+
+    def test_scheme_match(self):
+        self.assertEqual(self._match("https://ajax.googleapis.com"), ["ajax"])
+        self.assertEqual(self._match("ws://*.bar.com"), ["foo"])
+
+    def test_mismatch(self):
+        self.assertEqual(self._match("foobar.com"), [])
+        self.assertEqual(self._match("a.foo.bar.com"), [])
+        self.assertEqual(self._match("*.foo.com"), [])
+
+    def test_wildcard_excludes_apex(self):
+        self.assertEqual(self._match("*.bar.com"), ["foo"])
+        self.assertFalse("bar" in self._match("*.bar.com"))
+        self.assertEqual(self._match("*.com"), ["ajax", "bar", "foo"])
+
+
+class TestCSPIterHeaders(unittest.TestCase):
+
+    RESPONSE = bytearray(
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: text/html\r\n"
+        "Content-Security-Policy: default-src 'self'\r\n"
+        "X-WebKit-CSP:script-src 'none'\r\n"
+        "\r\n"
+        "Content-Security-Policy: default-src *\r\n")
+
+    def test_csp_headers(self):
+        self.assertEqual(list(csp_iter_headers(self.RESPONSE)), [
+            ("content-security-policy", "default-src 'self'"),
+            ("x-webkit-csp", "script-src 'none'")])
+
+    def test_no_csp_headers(self):
+        response = bytearray("HTTP/1.1 204 No Content\r\nServer: test\r\n\r\n")
+        self.assertEqual(list(csp_iter_headers(response)), [])
+
+    def test_no_body(self):
+        response = bytearray("HTTP/1.1 200 OK\r\nContent-Security-Policy: default-src 'none'")
+        self.assertEqual(list(csp_iter_headers(response)), [
+            ("content-security-policy", "default-src 'none'")])
+
+    def test_lf_only(self):
+        response = bytearray(
+            "HTTP/1.1 200 OK\n"
+            "Content-Security-Policy: default-src 'self'\n"
+            "\n"
+            "Content-Security-Policy: script-src *\n")
+        self.assertEqual(list(csp_iter_headers(response)), [
+            ("content-security-policy", "default-src 'self'")])
+
+    def test_folded_header(self):
+        response = bytearray(
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Security-Policy: default-src 'self';\r\n"
+            " script-src ajax.googleapis.com\r\n"
+            "\tstyle-src 'self'\r\n"
+            "Content-Type: text/html\r\n"
+            "\r\n")
+        self.assertEqual(list(csp_iter_headers(response)), [
+            ("content-security-policy",
+             "default-src 'self'; script-src ajax.googleapis.com style-src 'self'")])
+
+
 if __name__ == '__main__':
     unittest.main()